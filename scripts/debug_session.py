@@ -1,47 +1,33 @@
 #!/usr/bin/env python3
-"""debug v3: 打印 end_marker 之前的原始 before 内容"""
-import pexpect, yaml, time, re, sys
-from pathlib import Path
-
-SKILL_DIR = Path(__file__).parent.parent
-cfg = yaml.safe_load(open(SKILL_DIR / "resources" / "config.yaml"))
-js = cfg["jumpserver"]
-
-ssh_cmd = (f"ssh -p {js['port']} -o StrictHostKeyChecking=no "
-           f"-o UserKnownHostsFile=/dev/null -o ConnectTimeout=15 "
-           f"{js['user']}@{js['host']}")
-child = pexpect.spawn(ssh_cmd, encoding="utf-8", codec_errors="replace",
-                      timeout=30, dimensions=(50, 220))
-
-# 登录
-child.expect("password:", timeout=20)
-child.sendline(js["password"])
-child.expect("Opt>", timeout=15)
-# drain 双重 Opt>
-try: child.expect("Opt>", timeout=1.5)
-except pexpect.TIMEOUT: pass
-time.sleep(0.3)
-
-# 搜索
-child.send("4.13\r")
-idx = child.expect([r"\$\s", r"#\s", "Opt>", pexpect.TIMEOUT], timeout=15)
-print(f"after search: idx={idx}, before={repr(child.before[-500:])}", file=sys.stderr)
-
-# 如果进了 shell
-if idx in (0, 1):
-    time.sleep(1.0)
-    child.sendline("")
-    child.expect([r"\$\s*\r?\n", r"#\s*\r?\n", pexpect.TIMEOUT], timeout=8)
-
-    end_marker = f"__JUMP_END_{int(time.time())}__"
-    cmd = "kubectl get namespace"
-    child.sendline(f"{cmd}; echo '{end_marker}'")
-    child.expect(re.escape(end_marker), timeout=30)
-
-    raw = child.before or ""
-    print(f"\n===RAW BEFORE (repr)===\n{repr(raw[:2000])}", file=sys.stderr)
-    print(f"\n===RAW BEFORE (text)===\n{raw[:2000]}", file=sys.stderr)
-else:
-    print(f"没有进入 shell，idx={idx}", file=sys.stderr)
-
-child.close()
+"""debug v4: 复用 jump_ssh 的会话逻辑执行命令，并把终端原始输出打印到 stderr
+
+用法:
+    python debug_session.py --host VM-4-13 --cmd "kubectl get namespace"
+"""
+import argparse
+import sys
+
+from jump_ssh import SSHJumpSession, load_config, lookup_host, print_json
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="调试 JumpServer 会话：打印命令执行期间的原始终端输出")
+    parser.add_argument("--config", help="配置文件路径（默认: resources/config.yaml）")
+    parser.add_argument("--host", required=True, help="目标服务器名称（来自白名单 name 字段）")
+    parser.add_argument("--cmd", default="kubectl get namespace", help="要执行的 shell 命令")
+    args = parser.parse_args()
+
+    cfg = load_config(args.config)
+    _, target_ip, target_user, _ = lookup_host(cfg, args.host)
+    session = SSHJumpSession(cfg, target_ip, target_user)
+    try:
+        session.connect()
+        # 原始字节流（含 ANSI 序列和标记行）直接写到 stderr，清洗后的结果写到 stdout
+        session.child.logfile_read = sys.stderr
+        print_json(session.exec_command(args.cmd))
+    finally:
+        session.close()
+
+
+if __name__ == "__main__":
+    main()
@@ -5,15 +5,20 @@ jump-ssh: 通过 JumpServer 直连目标服务器执行命令
 用法:
     python jump_ssh.py list
     python jump_ssh.py exec --host VM-4-13 --cmd "ls"
+    python jump_ssh.py exec-all --cmd "uptime" [--hosts VM-4-13,IDC-2080]
+    python jump_ssh.py warm --host VM-4-13
     python jump_ssh.py session-start --host VM-4-13
     python jump_ssh.py session-exec --session <id> --cmd "pwd"
     python jump_ssh.py session-close --session <id>
 """
 
 import argparse
+import functools
 import hashlib
 import importlib
 import json
+import os
+import pickle
 import re
 import shlex
 import socket
@@ -23,21 +28,70 @@ import sys
 import threading
 import time
 import uuid
+from concurrent.futures import ThreadPoolExecutor
 from pathlib import Path
-from typing import Any, Optional
+from typing import Any, Iterator, Optional
 
 import pexpect
 import yaml
 
-SKILL_DIR = Path(__file__).parent.parent
-DEFAULT_CONFIG = SKILL_DIR / "resources" / "config.yaml"
+try:
+    import orjson
+except ImportError:  # 可选依赖：未安装时使用标准库 json
+    orjson = None
+
+try:
+    from yaml import CSafeLoader as YAMLLoader
+except ImportError:  # 未编译 libyaml 时退回纯 Python 实现
+    from yaml import SafeLoader as YAMLLoader
+
 CACHE_DIR = Path.home() / ".cache" / "jump-ssh"
-PROMPT_SHELL = [r"\$\s*$", r"#\s*$"]
-SESSION_PROTOCOL_VERSION = "2"
+CONTROL_DIR = CACHE_DIR / "cm"
+PROMPT_SHELL = r"[$#]\s*$"
+# 登录阶段的提示合成一个交替正则，每次读到数据只需扫描一遍；命中哪一类看 match.lastgroup
+AUTH_PROMPTS = re.compile(
+    r"(?P<host_key>(?i:are you sure you want to continue connecting))|(?P<password>(?i:password:))"
+)
+LOGIN_PROMPTS = re.compile(rf"{AUTH_PROMPTS.pattern}|(?P<shell>{PROMPT_SHELL})")
+# 登录提示总是出现在输出末尾（之后在等输入），只需扫描缓冲区尾部，长 banner 不会被反复全量扫描
+LOGIN_SEARCH_WINDOW = 2048
+READ_CHUNK_SIZE = 65536
+# 行足够宽就不会折行重绘；TERM=dumb 让 bash/ls/kubectl 等直接不输出颜色和光标控制序列
+PTY_DIMENSIONS = (24, 512)
+PTY_TERM = "dumb"
+# 第一批命令前执行：关闭终端回显，之后的长命令行不再被原样回传（也不会因折行产生重绘序列）；
+# 同时关掉分页器，否则 git log/man 等在 dumb 终端下会停在 less 的提示上等输入
+SHELL_SETUP = "stty -echo 2>/dev/null; export PAGER=cat GIT_PAGER=cat MANPAGER=cat SYSTEMD_PAGER="
+ANSI_ESCAPE = re.compile(r"\x1b\[[0-9;?]*[a-zA-Z]")
+MARKER_PREFIX = "__JUMP"
+BEGIN_MARKER = f"{MARKER_PREFIX}_BEGIN__"
+EXIT_MARKER = f"{MARKER_PREFIX}_EXIT__"
+END_MARKER = f"{MARKER_PREFIX}_END__"
+EXIT_MARKER_LINE = re.compile(rf"{EXIT_MARKER} (\S+) (\d+)")
+SESSION_PROTOCOL_VERSION = "3"
+POOL_IDLE_SECONDS = 600
+POOL_REAP_INTERVAL = 30
+EXEC_ALL_CONCURRENCY = 16
+
+
+def dumps_json(payload: Any, indent: bool = False) -> bytes:
+    # 大输出时 orjson 序列化比标准库快数倍
+    if orjson is not None:
+        try:
+            return orjson.dumps(payload, option=orjson.OPT_INDENT_2 if indent else 0)
+        except TypeError:
+            pass  # 超出 64 位的整数、非字符串键等交给标准库处理
+    return json.dumps(payload, ensure_ascii=False, indent=2 if indent else None).encode("utf-8")
+
+
+def loads_json(data: bytes) -> Any:
+    if orjson is not None:
+        return orjson.loads(data)
+    return json.loads(data.decode("utf-8"))
 
 
 def print_json(payload: dict[str, Any]) -> None:
-    print(json.dumps(payload, ensure_ascii=False, indent=2), flush=True)
+    print(dumps_json(payload, indent=True).decode("utf-8"), flush=True)
 
 
 def fatal(msg: str) -> None:
@@ -45,29 +99,95 @@ def fatal(msg: str) -> None:
     sys.exit(1)
 
 
+@functools.cache
+def skill_dir() -> Path:
+    return Path(__file__).resolve().parent.parent
+
+
+@functools.cache
+def default_config_path() -> Path:
+    return skill_dir() / "resources" / "config.yaml"
+
+
 def resolved_config_path(config_path: Optional[str]) -> Path:
-    return Path(config_path).expanduser().resolve() if config_path else DEFAULT_CONFIG.resolve()
+    # 默认路径在首次需要时才计算并缓存；脚本被循环调用时省去导入期的路径拼接与 resolve
+    return Path(config_path).expanduser().resolve() if config_path else default_config_path()
+
+
+def config_cache_path(path: Path) -> Path:
+    digest = hashlib.sha256(str(path).encode("utf-8")).hexdigest()[:12]
+    return CACHE_DIR / f"config-{digest}.pkl"
+
+
+def save_config_cache(cache_path: Path, stamp: tuple[int, int], cfg: dict[str, Any]) -> None:
+    try:
+        cache_path.parent.mkdir(parents=True, exist_ok=True)
+        tmp_path = cache_path.with_name(f"{cache_path.name}.{os.getpid()}.tmp")
+        # 配置里含密码，缓存文件只允许当前用户读写
+        fd = os.open(tmp_path, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o600)
+        with os.fdopen(fd, "wb") as f:
+            pickle.dump((stamp, cfg), f, protocol=pickle.HIGHEST_PROTOCOL)
+        os.replace(tmp_path, cache_path)
+    except OSError:
+        pass
 
 
 def load_config(config_path: Optional[str] = None) -> dict[str, Any]:
     path = resolved_config_path(config_path)
     if not path.exists():
-        example = SKILL_DIR / "resources" / "config.example.yaml"
+        example = skill_dir() / "resources" / "config.example.yaml"
         fatal(f"配置文件不存在: {path}\n请参考 {example} 创建配置文件")
+
+    stat = path.stat()
+    stamp = (stat.st_mtime_ns, stat.st_size)
+    cache_path = config_cache_path(path)
+    try:
+        with open(cache_path, "rb") as f:
+            cached_stamp, cached_cfg = pickle.load(f)
+        if cached_stamp == stamp:
+            return cached_cfg
+    except Exception:
+        pass
+
     with open(path, "r", encoding="utf-8") as f:
-        return yaml.safe_load(f)
+        cfg = yaml.load(f, Loader=YAMLLoader)
+    save_config_cache(cache_path, stamp, cfg)
+    return cfg
 
 
-def resolve_host(name: str, allowed_hosts: list[dict[str, Any]]) -> Optional[dict[str, Any]]:
+def build_host_index(allowed_hosts: list[dict[str, Any]]) -> dict[str, dict[str, Any]]:
+    index: dict[str, dict[str, Any]] = {}
     for host in allowed_hosts:
-        if host["name"].lower() == name.lower():
-            return host
-    return None
+        # 与逐个比较时一致：重名时取第一个
+        index.setdefault(host["name"].lower(), host)
+    return index
+
+
+def resolve_host(name: str, cfg: dict[str, Any]) -> Optional[dict[str, Any]]:
+    index = cfg.get("_host_index")
+    if index is None:
+        index = cfg["_host_index"] = build_host_index(cfg.get("allowed_hosts", []))
+    return index.get(name.lower())
+
+
+def strip_ansi(text: str) -> str:
+    # 绝大多数输出不含 ESC，先用 C 层的子串查找跳过正则；\r 用 str.replace 去掉
+    if "\x1b" in text:
+        text = ANSI_ESCAPE.sub("", text)
+    return text.replace("\r", "")
+
+
+def printf_marker(marker: str, token: str, value: Optional[str] = None) -> str:
+    """生成输出标记的 printf 命令；标记拆成两段引号，命令回显里不会出现完整标记。"""
+    suffix = marker[len(MARKER_PREFIX):]
+    if value is None:
+        return f"printf '{MARKER_PREFIX}''{suffix} {token}\\n'"
+    return f"printf '{MARKER_PREFIX}''{suffix} {token} %s\\n' {value}"
 
 
 def lookup_host(cfg: dict[str, Any], host_name: str) -> tuple[dict[str, Any], str, str, Optional[str]]:
     allowed = cfg.get("allowed_hosts", [])
-    host = resolve_host(host_name, allowed)
+    host = resolve_host(host_name, cfg)
     if not host:
         available = [item["name"] for item in allowed]
         raise ValueError(f"服务器 '{host_name}' 不在允许列表中。可用: {available}")
@@ -91,6 +211,9 @@ class SSHJumpSession:
         self.js_user = js["user"]
         self.password = js.get("password")
         self.direct_user = f"{self.js_user}@{target_user}@{target_ip}"
+        self.multiplex = bool(js.get("multiplex", True))
+        self.control_persist = int(js.get("control_persist", 600))
+        self.compress = bool(js.get("compress", True))
 
         timeouts = cfg.get("timeout", {})
         self.t_connect = timeouts.get("connect", 15)
@@ -99,11 +222,11 @@ class SSHJumpSession:
 
         self.child: Optional[pexpect.spawn] = None
         self.command_lock = threading.Lock()
+        self.shell_prepared = False
+        self.last_exit_code: Optional[int] = None
 
-    def connect(self) -> None:
-        cmd = [
-            "ssh",
-            "-tt",
+    def _ssh_options(self) -> list[str]:
+        options = [
             "-p",
             str(self.port),
             "-o",
@@ -112,49 +235,110 @@ class SSHJumpSession:
             "UserKnownHostsFile=/dev/null",
             "-o",
             f"ConnectTimeout={self.t_connect}",
-            "-l",
-            self.direct_user,
-            self.host,
+            "-o",
+            # kubectl/日志这类重复文本压缩后通常只剩 10%~30%，交互式场景下 zlib 的 CPU 开销可忽略
+            f"Compression={'yes' if self.compress else 'no'}",
         ]
+        if self.multiplex:
+            # %C 是连接参数的哈希，避免 user@target@ip 过长超出 Unix socket 路径限制
+            CONTROL_DIR.mkdir(mode=0o700, parents=True, exist_ok=True)
+            options += [
+                "-o",
+                "ControlMaster=auto",
+                "-o",
+                f"ControlPath={CONTROL_DIR / '%C'}",
+                "-o",
+                f"ControlPersist={self.control_persist}",
+            ]
+        return options + ["-l", self.direct_user]
+
+    def master_alive(self) -> bool:
+        if not self.multiplex:
+            return False
+        try:
+            result = subprocess.run(
+                ["ssh", *self._ssh_options(), "-O", "check", self.host],
+                stdin=subprocess.DEVNULL,
+                capture_output=True,
+                timeout=self.t_connect,
+            )
+        except (OSError, subprocess.TimeoutExpired):
+            return False
+        return result.returncode == 0
+
+    def warm(self) -> bool:
+        """建立 ControlMaster 复用连接，返回 master 在调用前是否已存在。"""
+        if not self.multiplex:
+            raise RuntimeError("配置中 jumpserver.multiplex 已关闭，无法预热复用连接")
+        if self.master_alive():
+            return True
+
+        cmd = ["ssh", *self._ssh_options(), "-f", "-N", self.host]
         child = pexpect.spawn(
             cmd[0],
             cmd[1:],
             encoding="utf-8",
             codec_errors="replace",
             timeout=max(self.t_connect, self.t_expect),
-            dimensions=(50, 220),
         )
+        try:
+            if self._answer_login(child, AUTH_PROMPTS) == "timeout":
+                raise RuntimeError(f"建立复用连接超时: {(child.before or '').strip()}")
+        finally:
+            child.close(force=True)
 
+        if not self.master_alive():
+            raise RuntimeError(f"建立复用连接失败: {(child.before or '').strip()}")
+        return False
+
+    def connect(self) -> None:
+        cmd = ["ssh", "-tt", *self._ssh_options(), self.host]
+        child = pexpect.spawn(
+            cmd[0],
+            cmd[1:],
+            encoding="utf-8",
+            codec_errors="replace",
+            timeout=max(self.t_connect, self.t_expect),
+            dimensions=PTY_DIMENSIONS,
+            env={**os.environ, "TERM": PTY_TERM},
+            # pexpect 默认每次只读 2000 字节，大输出时 Python 层读循环次数过多
+            maxread=READ_CHUNK_SIZE,
+        )
         try:
-            while True:
-                idx = child.expect(
-                    [
-                        r"(?i)are you sure you want to continue connecting",
-                        r"(?i)password:",
-                        *PROMPT_SHELL,
-                        pexpect.EOF,
-                        pexpect.TIMEOUT,
-                    ],
-                    timeout=max(self.t_connect, self.t_expect),
-                )
-                if idx == 0:
-                    child.sendline("yes")
-                    continue
-                if idx == 1:
-                    if self.password is None:
-                        raise RuntimeError("JumpServer 要求密码，但配置中未提供 password")
-                    child.sendline(self.password)
-                    continue
-                if idx in (2, 3):
-                    self.child = child
-                    return
-                if idx == 4:
-                    raise RuntimeError(f"SSH 连接提前关闭: {(child.before or '').strip()}")
-                raise RuntimeError(f"SSH 连接超时: {(child.before or '').strip()}")
+            outcome = self._answer_login(child, LOGIN_PROMPTS)
+            if outcome == "shell":
+                self.child = child
+                return
+            if outcome == "eof":
+                raise RuntimeError(f"SSH 连接提前关闭: {(child.before or '').strip()}")
+            raise RuntimeError(f"SSH 连接超时: {(child.before or '').strip()}")
         except Exception:
             child.close(force=True)
             raise
 
+    def _answer_login(self, child: pexpect.spawn, prompts: re.Pattern) -> str:
+        """应答 host key 确认与密码提示，返回最终结果：shell、eof 或 timeout。"""
+        while True:
+            idx = child.expect_list(
+                [prompts, pexpect.EOF, pexpect.TIMEOUT],
+                timeout=max(self.t_connect, self.t_expect),
+                searchwindowsize=LOGIN_SEARCH_WINDOW,
+            )
+            if idx == 1:
+                return "eof"
+            if idx == 2:
+                return "timeout"
+
+            kind = child.match.lastgroup
+            if kind == "host_key":
+                child.sendline("yes")
+            elif kind == "password":
+                if self.password is None:
+                    raise RuntimeError("JumpServer 要求密码，但配置中未提供 password")
+                child.sendline(self.password)
+            else:
+                return kind
+
     def is_alive(self) -> bool:
         return bool(self.child and self.child.isalive())
 
@@ -163,73 +347,147 @@ class SSHJumpSession:
             self.child.close(force=True)
 
     def exec_command(self, command: str) -> dict[str, Any]:
+        return self.exec_commands([command])[0]
+
+    def exec_commands(self, commands: list[str]) -> list[dict[str, Any]]:
+        """一次发送多条命令，按各自的结束标记依次收集输出，省去逐条往返。"""
+        if not commands:
+            raise ValueError("commands 不能为空")
         if not self.child or not self.is_alive():
             raise RuntimeError("session 已断开")
 
         with self.command_lock:
-            token = uuid.uuid4().hex
-            exit_marker = f"__JUMP_EXIT__ {token}"
-            end_marker = f"__JUMP_END__ {token}"
-            marker_prefix = "__JUMP"
-            exit_suffix = f"_EXIT__ {token}"
-            end_suffix = f"_END__ {token}"
-            full_cmd = (
-                f"{command}; "
-                "__jump_ssh_exit=$?; "
-                f"printf '{marker_prefix}''{exit_suffix} %s\\n' \"$__jump_ssh_exit\"; "
-                f"printf '{marker_prefix}''{end_suffix}\\n'"
-            )
+            tokens = self._send_batch(commands)
+            results = []
+            for command, token in zip(commands, tokens):
+                self._expect_marker(f"{END_MARKER} {token}")
+                output, exit_code = self._clean(self.child.before or "", token)
+                results.append({"command": command, "output": output, "exit_code": exit_code})
+
+            # 结束标记之后的提示符留在缓冲区即可，下一次调用会随 BEGIN 标记之前的内容一起丢弃
+            alive = self.is_alive()
+            return [{**result, "alive": alive} for result in results]
+
+    def exec_stream(self, command: str) -> Iterator[str]:
+        """执行单条命令，按到达顺序逐块产出清洗后的输出，内存占用与输出总量无关。
+
+        结束后退出码写入 last_exit_code。与 exec_command 不同，空行原样保留；
+        command 超时按“连续多久没有新输出”计算。迭代期间一直持有 command_lock；
+        中途停止迭代（生成器被 close 或回收）会关闭 session，之后不能再复用。
+        """
+        if not self.child or not self.is_alive():
+            raise RuntimeError("session 已断开")
 
-            self.child.sendline(full_cmd)
+        with self.command_lock:
+            self.last_exit_code = None
+            token = self._send_batch([command])[0]
+            exit_prefix = f"{EXIT_MARKER} {token} "
+            end_marker = f"{END_MARKER} {token}"
+
+            # expect 到 BEGIN 时多读进来的数据留在 pexpect 缓冲区里，先取出来
+            pending = self.child.buffer
+            self.child.buffer = ""
+            # BEGIN 标记行本身的换行不属于命令输出
+            skip_newline = True
             try:
-                self.child.expect(re.escape(end_marker), timeout=self.t_cmd)
-            except pexpect.EOF as exc:
-                raise RuntimeError(f"session 在命令执行期间断开: {(self.child.before or '').strip()}") from exc
-            except pexpect.TIMEOUT as exc:
-                raise TimeoutError(f"命令执行超时: {(self.child.before or '').strip()}") from exc
-
-            raw = self.child.before or ""
-            self._drain_prompt()
-            output, exit_code = self._clean(raw, command, token)
-            return {
-                "command": command,
-                "output": output,
-                "exit_code": exit_code,
-                "alive": self.is_alive(),
-            }
-
-    def _drain_prompt(self) -> None:
-        if not self.child or not self.is_alive():
-            return
-        try:
-            self.child.expect(PROMPT_SHELL, timeout=0.5)
-        except (pexpect.TIMEOUT, pexpect.EOF):
-            pass
+                while True:
+                    index = pending.find(exit_prefix)
+                    if index >= 0:
+                        chunk = strip_ansi(pending[:index])
+                        if skip_newline and chunk.startswith("\n"):
+                            chunk = chunk[1:]
+                        if chunk:
+                            yield chunk
+                        tail = pending[index:]
+                        break
+
+                    # 末尾可能是被截断的退出标记，留到下一块再判断；
+                    # 截断点若落在 ANSI 序列中间（或序列还没读完），整个序列一起留下
+                    safe = len(pending) - len(exit_prefix) + 1
+                    escape = pending.rfind("\x1b", 0, max(safe, 0))
+                    if escape >= 0 and safe - escape < 32:
+                        match = ANSI_ESCAPE.match(pending, escape)
+                        if not match or match.end() > safe:
+                            safe = escape
+                    if safe > 0:
+                        chunk = strip_ansi(pending[:safe])
+                        pending = pending[safe:]
+                        if skip_newline and chunk:
+                            chunk = chunk[1:] if chunk.startswith("\n") else chunk
+                            skip_newline = False
+                        if chunk:
+                            yield chunk
+                    pending += self._read_chunk()
+            except GeneratorExit:
+                # 调用方中途停止读取：终端里还有未读输出且等不到结束标记，不能再复用，直接关闭
+                self.close()
+                raise
+
+            while end_marker not in tail:
+                tail += self._read_chunk()
+            match = EXIT_MARKER_LINE.match(tail)
+            if match and match.group(1) == token:
+                self.last_exit_code = int(match.group(2))
+            # 结束标记之后的提示符放回缓冲区，下一次调用会随 BEGIN 之前的内容一起丢弃
+            self.child.buffer = tail[tail.index(end_marker) + len(end_marker) :]
+
+    def _send_batch(self, commands: list[str]) -> list[str]:
+        """发送一批命令并等到 BEGIN 标记，返回每条命令的标记 token。"""
+        batch_token = uuid.uuid4().hex
+        tokens = [f"{batch_token}_{index}" for index in range(len(commands))]
+        parts = [
+            printf_marker(BEGIN_MARKER, batch_token),
+            *(self._wrap_command(command, token) for command, token in zip(commands, tokens)),
+        ]
+        if not self.shell_prepared:
+            # 随第一批命令一起发送，不额外增加往返
+            parts.insert(0, SHELL_SETUP)
+            self.shell_prepared = True
+        self.child.sendline("; ".join(parts))
 
-    @staticmethod
-    def _clean(raw: str, command: str, token: str) -> tuple[str, Optional[int]]:
-        ansi = re.compile(r"\x1b\[[0-9;?]*[a-zA-Z]|\x1b\[[0-9;]*m|\r")
-        cleaned = ansi.sub("", raw)
+        # 长命令行的回显会被终端折行/重绘，直接丢弃 BEGIN 标记之前的内容
+        self._expect_marker(f"{BEGIN_MARKER} {batch_token}")
+        return tokens
 
-        exit_code = None
-        exit_pattern = re.compile(rf"__JUMP_EXIT__ {re.escape(token)} (\d+)")
-        match = exit_pattern.search(cleaned)
-        if match:
-            exit_code = int(match.group(1))
-            cleaned = exit_pattern.sub("", cleaned)
+    def _read_chunk(self) -> str:
+        try:
+            return self.child.read_nonblocking(READ_CHUNK_SIZE, timeout=self.t_cmd)
+        except pexpect.EOF as exc:
+            raise RuntimeError("session 在命令执行期间断开") from exc
+        except pexpect.TIMEOUT as exc:
+            raise TimeoutError(f"命令执行超时: {self.t_cmd} 秒内没有新输出") from exc
 
-        lines = [line for line in cleaned.split("\n") if line.strip()]
-        if lines:
-            first = lines[0].strip()
-            cmd = command.strip()
-            if cmd and (first == cmd or first.startswith(cmd) or first.endswith(cmd)):
-                lines = lines[1:]
+    def _expect_marker(self, marker: str) -> None:
+        try:
+            # 字面量匹配只扫描新到达的数据（加上标记长度的回看），大输出时不会反复全量扫描缓冲区
+            self.child.expect_exact(marker, timeout=self.t_cmd)
+        except pexpect.EOF as exc:
+            raise RuntimeError(f"session 在命令执行期间断开: {(self.child.before or '').strip()}") from exc
+        except pexpect.TIMEOUT as exc:
+            raise TimeoutError(f"命令执行超时: {(self.child.before or '').strip()}") from exc
 
-        lines = [line for line in lines if "__JUMP_END__" not in line and "__JUMP_EXIT__" not in line]
+    @staticmethod
+    def _wrap_command(command: str, token: str) -> str:
+        print_exit = printf_marker(EXIT_MARKER, token, '"$__jump_ssh_exit"')
+        print_end = printf_marker(END_MARKER, token)
+        # 命令整体作为 eval 的一个参数：注释、结尾的 &、不完整的语法都只影响这一条，不会吞掉后面的标记
+        return f"eval {shlex.quote(command)}; __jump_ssh_exit=$?; {print_exit}; {print_end}"
 
-        if lines and re.match(r"^[^\n]*[#$]\s*$", lines[-1].strip()):
-            lines = lines[:-1]
+    @staticmethod
+    def _clean(raw: str, token: str) -> tuple[str, Optional[int]]:
+        cleaned = strip_ansi(raw)
 
+        exit_code = None
+        match = EXIT_MARKER_LINE.search(cleaned)
+        if match and match.group(1) == token:
+            exit_code = int(match.group(2))
+            cleaned = cleaned[: match.start()] + cleaned[match.end() :]
+
+        lines = [
+            line
+            for line in cleaned.split("\n")
+            if line.strip() and END_MARKER not in line and EXIT_MARKER not in line
+        ]
         return "\n".join(lines).strip(), exit_code
 
 
@@ -237,6 +495,7 @@ class SessionManager:
     def __init__(self, cfg: dict[str, Any]):
         self.cfg = cfg
         self.sessions: dict[str, dict[str, Any]] = {}
+        self.pool: dict[tuple[str, str], dict[str, Any]] = {}
         self.lock = threading.RLock()
 
     def list_sessions(self) -> list[dict[str, Any]]:
@@ -311,6 +570,60 @@ class SessionManager:
             **result,
         }
 
+    def run_pooled(self, host_name: str, commands: list[str], workdir: Optional[str]) -> dict[str, Any]:
+        """复用按 (ip, user) 缓存的终端执行命令，每条命令在子 shell 中运行以保持无状态语义。"""
+        host, target_ip, target_user, default_workdir = lookup_host(self.cfg, host_name)
+        effective_workdir = workdir or default_workdir
+        full_commands = with_workdir(commands, effective_workdir)
+
+        key = (target_ip, target_user)
+        with self.lock:
+            entry = self.pool.setdefault(key, {"session": None, "lock": threading.Lock(), "last_used": 0.0})
+
+        with entry["lock"]:
+            session = entry["session"]
+            if session is None or not session.is_alive():
+                session = SSHJumpSession(self.cfg, target_ip, target_user)
+                session.connect()
+                entry["session"] = session
+            try:
+                results = session.exec_commands([f"( eval {shlex.quote(command)} )" for command in full_commands])
+            except Exception:
+                session.close()
+                entry["session"] = None
+                raise
+            finally:
+                entry["last_used"] = time.time()
+
+        return {
+            "host": host["name"],
+            "ip": target_ip,
+            "user": target_user,
+            "workdir": effective_workdir,
+            "results": [
+                {**result, "command": command} for result, command in zip(results, full_commands)
+            ],
+        }
+
+    def reap_idle(self, max_idle: float) -> int:
+        now = time.time()
+        with self.lock:
+            entries = list(self.pool.values())
+
+        closed = 0
+        for entry in entries:
+            # 正在执行命令的终端不算空闲
+            if not entry["lock"].acquire(blocking=False):
+                continue
+            try:
+                if entry["session"] and now - entry["last_used"] > max_idle:
+                    entry["session"].close()
+                    entry["session"] = None
+                    closed += 1
+            finally:
+                entry["lock"].release()
+        return closed
+
     def close_session(self, session_id: str) -> dict[str, Any]:
         with self.lock:
             record = self.sessions.pop(session_id, None)
@@ -335,31 +648,63 @@ class SessionRequestHandler(socketserver.StreamRequestHandler):
             return
 
         try:
-            request = json.loads(raw.decode("utf-8"))
+            request = loads_json(raw)
             response = self.server.dispatch(request)
         except Exception as exc:  # pragma: no cover
             response = {"success": False, "error": f"{type(exc).__name__}: {exc}"}
 
-        self.wfile.write((json.dumps(response, ensure_ascii=False) + "\n").encode("utf-8"))
+        self.wfile.write(dumps_json(response) + b"\n")
 
 
 class SessionServer(socketserver.ThreadingMixIn, socketserver.UnixStreamServer):
     daemon_threads = True
     allow_reuse_address = True
 
-    def __init__(self, socket_path: str, cfg: dict[str, Any]):
+    def __init__(self, socket_path: str, cfg: dict[str, Any], config_path: Optional[str] = None):
         self.manager = SessionManager(cfg)
+        self.pool_idle = cfg.get("timeout", {}).get("pool_idle", POOL_IDLE_SECONDS)
+        self.config_path = Path(config_path) if config_path else None
+        self.config_stamp = self._config_stamp()
         super().__init__(socket_path, SessionRequestHandler)
+        threading.Thread(target=self._reap_loop, daemon=True).start()
+
+    def _config_stamp(self) -> Optional[tuple[int, int]]:
+        if self.config_path is None:
+            return None
+        stat = self.config_path.stat()
+        return (stat.st_mtime_ns, stat.st_size)
+
+    def _reload_config_if_changed(self) -> None:
+        """配置文件改动（如增删白名单）后重新加载，daemon 不会一直沿用启动时的旧配置。"""
+        stamp = self._config_stamp()
+        if stamp == self.config_stamp:
+            return
+        cfg = load_config(str(self.config_path))
+        self.manager.cfg = cfg
+        self.pool_idle = cfg.get("timeout", {}).get("pool_idle", POOL_IDLE_SECONDS)
+        self.config_stamp = stamp
+
+    def _reap_loop(self) -> None:
+        while True:
+            time.sleep(POOL_REAP_INTERVAL)
+            self.manager.reap_idle(self.pool_idle)
 
     def dispatch(self, request: dict[str, Any]) -> dict[str, Any]:
         action = request.get("action")
         try:
             if action == "ping":
                 return {"success": True, "pong": True}
+            # 配置文件被删除或解析失败时抛出异常，请求被拒绝而不是按旧白名单执行
+            self._reload_config_if_changed()
             if action == "list":
                 return {"success": True, "sessions": self.manager.list_sessions()}
             if action == "start":
                 return {"success": True, **self.manager.start_session(request["host"], request.get("workdir"))}
+            if action == "run":
+                return {
+                    "success": True,
+                    **self.manager.run_pooled(request["host"], request["commands"], request.get("workdir")),
+                }
             if action == "exec":
                 return {
                     "success": True,
@@ -423,7 +768,7 @@ def ping_server(socket_path: Path) -> bool:
         response = client.recv(4096)
         if not response:
             return False
-        payload = json.loads(response.decode("utf-8"))
+        payload = loads_json(response)
         return bool(payload.get("success") and payload.get("pong"))
     except Exception:
         return False
@@ -449,7 +794,7 @@ def ensure_server(socket_path: Path, config_path: Optional[str]) -> None:
             "--socket-path",
             str(socket_path),
         ],
-        cwd=str(SKILL_DIR),
+        cwd=str(skill_dir()),
         stdin=subprocess.DEVNULL,
         stdout=subprocess.DEVNULL,
         stderr=subprocess.DEVNULL,
@@ -471,19 +816,22 @@ def send_session_request(config_path: Optional[str], payload: dict[str, Any]) ->
     client = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
     try:
         client.connect(str(socket_path))
-        client.sendall((json.dumps(payload, ensure_ascii=False) + "\n").encode("utf-8"))
-        response_bytes = b""
-        while not response_bytes.endswith(b"\n"):
-            chunk = client.recv(65536)
+        client.sendall(dumps_json(payload) + b"\n")
+        # 分块收集后一次拼接，避免大输出时 bytes 反复拼接的二次方开销
+        chunks: list[bytes] = []
+        while True:
+            chunk = client.recv(READ_CHUNK_SIZE)
             if not chunk:
                 break
-            response_bytes += chunk
+            chunks.append(chunk)
+            if chunk.endswith(b"\n"):
+                break
     finally:
         client.close()
 
-    if not response_bytes:
+    if not chunks:
         raise RuntimeError("session daemon 未返回数据")
-    return json.loads(response_bytes.decode("utf-8"))
+    return loads_json(b"".join(chunks))
 
 
 def cmd_list(cfg: dict[str, Any]) -> None:
@@ -504,27 +852,65 @@ def cmd_list(cfg: dict[str, Any]) -> None:
     print_json({"success": True, "hosts": result})
 
 
-def cmd_exec(cfg: dict[str, Any], host_name: str, command: str, workdir: Optional[str] = None) -> None:
-    _, target_ip, target_user, default_workdir = lookup_host(cfg, host_name)
-    effective_workdir = workdir or default_workdir
+def with_workdir(commands: list[str], workdir: Optional[str]) -> list[str]:
+    if not workdir:
+        return list(commands)
+    return [f"cd {shlex.quote(workdir)} && {command}" for command in commands]
+
+
+def read_commands_file(path: str) -> list[str]:
+    with open(Path(path).expanduser(), "r", encoding="utf-8") as f:
+        # 每行是一条独立命令；空行和 # 注释行跳过
+        commands = [line.strip() for line in f if line.strip() and not line.lstrip().startswith("#")]
+    if not commands:
+        raise ValueError(f"命令文件为空: {path}")
+    return commands
+
 
-    if effective_workdir:
-        command = f"cd {shlex.quote(effective_workdir)} && {command}"
+def exec_payload(meta: dict[str, Any], results: list[dict[str, Any]], batch: bool) -> dict[str, Any]:
+    if batch:
+        return {"success": True, **meta, "results": results}
+    return {"success": True, **meta, **results[0]}
+
+
+def cmd_exec(
+    cfg: dict[str, Any],
+    host_name: str,
+    commands: list[str],
+    workdir: Optional[str] = None,
+    config_path: Optional[str] = None,
+    reuse: bool = False,
+    batch: bool = False,
+) -> None:
+    if reuse:
+        try:
+            response = send_session_request(
+                config_path,
+                {"action": "run", "host": host_name, "commands": commands, "workdir": workdir},
+            )
+        except Exception as exc:
+            fatal(f"session daemon 调用失败: {type(exc).__name__}: {exc}")
+        if not response.get("success"):
+            fatal(f"执行失败: {response.get('error')}")
+        results = response.pop("results")
+        response.pop("success")
+        print_json(exec_payload(response, results, batch))
+        return
+
+    host, target_ip, target_user, default_workdir = lookup_host(cfg, host_name)
+    effective_workdir = workdir or default_workdir
 
     session = SSHJumpSession(cfg, target_ip, target_user)
     try:
         session.connect()
-        result = session.exec_command(command)
-        print_json(
-            {
-                "success": True,
-                "host": host_name,
-                "ip": target_ip,
-                "user": target_user,
-                "workdir": effective_workdir,
-                **result,
-            }
-        )
+        results = session.exec_commands(with_workdir(commands, effective_workdir))
+        meta = {
+            "host": host["name"],
+            "ip": target_ip,
+            "user": target_user,
+            "workdir": effective_workdir,
+        }
+        print_json(exec_payload(meta, results, batch))
     except TimeoutError as exc:
         fatal(f"超时: {exc}")
     except RuntimeError as exc:
@@ -535,6 +921,117 @@ def cmd_exec(cfg: dict[str, Any], host_name: str, command: str, workdir: Optiona
         session.close()
 
 
+def cmd_exec_stream(cfg: dict[str, Any], host_name: str, command: str, workdir: Optional[str] = None) -> None:
+    """把输出边执行边写到 stdout（不包 JSON），进程退出码即远端命令退出码。"""
+    session = None
+    try:
+        _, target_ip, target_user, default_workdir = lookup_host(cfg, host_name)
+        command = with_workdir([command], workdir or default_workdir)[0]
+        session = SSHJumpSession(cfg, target_ip, target_user)
+        session.connect()
+        for chunk in session.exec_stream(command):
+            sys.stdout.write(chunk)
+            sys.stdout.flush()
+    except BrokenPipeError:
+        # 下游（如 | head）提前关闭是正常结束；把 stdout 指向 /dev/null，避免解释器退出时刷新再报错
+        try:
+            os.dup2(os.open(os.devnull, os.O_WRONLY), sys.stdout.fileno())
+        except (OSError, ValueError):
+            pass
+        sys.exit(0)
+    except TimeoutError as exc:
+        print(f"超时: {exc}", file=sys.stderr)
+        sys.exit(1)
+    except (RuntimeError, ValueError) as exc:
+        print(f"执行失败: {exc}", file=sys.stderr)
+        sys.exit(1)
+    except Exception as exc:
+        print(f"未知错误: {type(exc).__name__}: {exc}", file=sys.stderr)
+        sys.exit(1)
+    finally:
+        if session is not None:
+            session.close()
+    sys.exit(session.last_exit_code if session.last_exit_code is not None else 1)
+
+
+def run_on_host(
+    cfg: dict[str, Any],
+    host_name: str,
+    commands: list[str],
+    workdir: Optional[str],
+    batch: bool,
+) -> dict[str, Any]:
+    host, target_ip, target_user, default_workdir = lookup_host(cfg, host_name)
+    effective_workdir = workdir or default_workdir
+    meta = {
+        "host": host["name"],
+        "ip": target_ip,
+        "user": target_user,
+        "workdir": effective_workdir,
+    }
+
+    session = SSHJumpSession(cfg, target_ip, target_user)
+    try:
+        session.connect()
+        results = session.exec_commands(with_workdir(commands, effective_workdir))
+    except Exception as exc:
+        return {"success": False, **meta, "error": f"{type(exc).__name__}: {exc}"}
+    finally:
+        session.close()
+    return exec_payload(meta, results, batch)
+
+
+def cmd_exec_all(
+    cfg: dict[str, Any],
+    commands: list[str],
+    host_names: Optional[list[str]] = None,
+    workdir: Optional[str] = None,
+    concurrency: int = EXEC_ALL_CONCURRENCY,
+    batch: bool = False,
+) -> None:
+    names = host_names or [host["name"] for host in cfg.get("allowed_hosts", [])]
+    if not names:
+        fatal("配置文件中 allowed_hosts 为空")
+    # 按白名单中的规范名称去重（大小写不敏感），同一台主机只执行一次，结果也以规范名称为键
+    canonical: dict[str, str] = {}
+    for name in names:
+        try:
+            host = lookup_host(cfg, name)[0]
+        except ValueError as exc:
+            fatal(str(exc))
+        canonical.setdefault(host["name"].lower(), host["name"])
+    names = list(canonical.values())
+
+    # 每台主机的耗时基本都在网络等待上，线程并发即可把总耗时从累加降到取最大值
+    with ThreadPoolExecutor(max_workers=max(1, min(concurrency, len(names)))) as pool:
+        futures = {name: pool.submit(run_on_host, cfg, name, commands, workdir, batch) for name in names}
+        results = {name: future.result() for name, future in futures.items()}
+
+    success = all(result["success"] for result in results.values())
+    print_json({"success": success, "hosts": results})
+    if not success:
+        sys.exit(1)
+
+
+def cmd_warm(cfg: dict[str, Any], host_name: str) -> None:
+    _, target_ip, target_user, _ = lookup_host(cfg, host_name)
+    session = SSHJumpSession(cfg, target_ip, target_user)
+    try:
+        reused = session.warm()
+    except Exception as exc:
+        fatal(f"预热失败: {exc}")
+    print_json(
+        {
+            "success": True,
+            "host": host_name,
+            "ip": target_ip,
+            "user": target_user,
+            "reused": reused,
+            "control_persist": session.control_persist,
+        }
+    )
+
+
 def cmd_session_start(config_path: Optional[str], host_name: str, workdir: Optional[str]) -> None:
     response = send_session_request(
         config_path,
@@ -564,13 +1061,13 @@ def cmd_session_close(config_path: Optional[str], session_id: str) -> None:
     print_json(response)
 
 
-def cmd_serve(cfg: dict[str, Any], socket_path: str) -> None:
+def cmd_serve(cfg: dict[str, Any], socket_path: str, config_path: Optional[str] = None) -> None:
     path = Path(socket_path)
     path.parent.mkdir(parents=True, exist_ok=True)
     if path.exists():
         path.unlink()
 
-    server = SessionServer(str(path), cfg)
+    server = SessionServer(str(path), cfg, str(resolved_config_path(config_path)))
     try:
         server.serve_forever(poll_interval=0.2)
     finally:
@@ -713,8 +1210,36 @@ def build_parser() -> argparse.ArgumentParser:
 
     exec_parser = subparsers.add_parser("exec", help="在指定服务器上执行命令")
     exec_parser.add_argument("--host", required=True, help="目标服务器名称（来自白名单 name 字段）")
-    exec_parser.add_argument("--cmd", required=True, help="要执行的 shell 命令")
+    exec_commands = exec_parser.add_mutually_exclusive_group(required=True)
+    exec_commands.add_argument("--cmd", help="要执行的 shell 命令")
+    exec_commands.add_argument("--cmds-file", default=None, help="批量执行的命令文件，每行一条命令，一次往返依次执行")
     exec_parser.add_argument("--workdir", default=None, help="工作目录，进入服务器后先 cd 到该目录")
+    exec_parser.add_argument(
+        "--reuse",
+        action="store_true",
+        help="通过本地 session daemon 复用远端终端（daemon 未运行时自动启动）",
+    )
+    exec_parser.add_argument(
+        "--stream",
+        action="store_true",
+        help="边执行边输出原始文本（不包 JSON），退出码为远端命令退出码；仅支持单条 --cmd",
+    )
+
+    exec_all = subparsers.add_parser("exec-all", help="在多台服务器上并发执行同一命令")
+    exec_all.add_argument("--hosts", default=None, help="逗号分隔的目标服务器名称；未传时使用全部白名单")
+    exec_all_commands = exec_all.add_mutually_exclusive_group(required=True)
+    exec_all_commands.add_argument("--cmd", help="要执行的 shell 命令")
+    exec_all_commands.add_argument("--cmds-file", default=None, help="批量执行的命令文件，每行一条命令")
+    exec_all.add_argument("--workdir", default=None, help="工作目录；未指定时使用各主机的 default_workdir")
+    exec_all.add_argument(
+        "--concurrency",
+        type=int,
+        default=EXEC_ALL_CONCURRENCY,
+        help=f"最大并发主机数（默认: {EXEC_ALL_CONCURRENCY}）",
+    )
+
+    warm_parser = subparsers.add_parser("warm", help="预先建立 ssh ControlMaster 复用连接")
+    warm_parser.add_argument("--host", required=True, help="目标服务器名称（来自白名单 name 字段）")
 
     session_start = subparsers.add_parser("session-start", help="启动持久终端 session")
     session_start.add_argument("--host", required=True, help="目标服务器名称（来自白名单 name 字段）")
@@ -764,15 +1289,56 @@ def main() -> None:
     args = parser.parse_args()
 
     if args.subcommand == "serve":
-        cmd_serve(load_config(args.config), args.socket_path)
+        cmd_serve(load_config(args.config), args.socket_path, args.config)
         return
 
     if args.subcommand == "list":
         cmd_list(load_config(args.config))
         return
 
+    # 参数组合校验要先于读取命令文件，否则会先报出文件相关的错误
+    if args.subcommand == "exec" and args.stream and (args.cmds_file or args.reuse):
+        parser.error("--stream 只支持单条 --cmd，且不能与 --reuse 同时使用")
+
+    if args.subcommand in ("exec", "exec-all"):
+        if args.cmds_file:
+            try:
+                commands = read_commands_file(args.cmds_file)
+            except (OSError, ValueError) as exc:
+                fatal(f"读取命令文件失败: {exc}")
+        else:
+            commands = [args.cmd]
+
+    if args.subcommand == "exec-all":
+        host_names = [name.strip() for name in args.hosts.split(",") if name.strip()] if args.hosts else None
+        cmd_exec_all(
+            load_config(args.config),
+            commands,
+            host_names,
+            args.workdir,
+            args.concurrency,
+            batch=bool(args.cmds_file),
+        )
+        return
+
+    if args.subcommand == "exec" and args.stream:
+        cmd_exec_stream(load_config(args.config), args.host, args.cmd, args.workdir)
+        return
+
     if args.subcommand == "exec":
-        cmd_exec(load_config(args.config), args.host, args.cmd, args.workdir)
+        cmd_exec(
+            load_config(args.config),
+            args.host,
+            commands,
+            args.workdir,
+            args.config,
+            args.reuse,
+            batch=bool(args.cmds_file),
+        )
+        return
+
+    if args.subcommand == "warm":
+        cmd_warm(load_config(args.config), args.host)
         return
 
     if args.subcommand == "session-start":
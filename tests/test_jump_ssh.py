@@ -3,6 +3,8 @@ import io
 from pathlib import Path
 from types import SimpleNamespace
 
+import pytest
+
 
 MODULE_PATH = Path("/home/sanmu/.agents/skills/jump-ssh/scripts/jump_ssh.py")
 SPEC = importlib.util.spec_from_file_location("jump_ssh_script", MODULE_PATH)
@@ -11,6 +13,78 @@ assert SPEC.loader is not None
 SPEC.loader.exec_module(jump_ssh)
 
 
+@pytest.fixture
+def local_bash_session():
+    """挂在本地 bash pty 上的 SSHJumpSession，用来验证命令标记协议。"""
+    cfg = {"jumpserver": {"host": "1.1.1.1", "port": 2222, "user": "u"}, "timeout": {"command": 10}}
+    session = jump_ssh.SSHJumpSession(cfg, "192.168.4.13", "root")
+    session.child = jump_ssh.pexpect.spawn(
+        "bash",
+        ["--norc", "--noprofile"],
+        env={"PS1": "$ ", "PATH": "/usr/bin:/bin", "TERM": "dumb"},
+        encoding="utf-8",
+        timeout=10,
+        maxread=jump_ssh.READ_CHUNK_SIZE,
+    )
+    try:
+        session.child.expect(jump_ssh.PROMPT_SHELL)
+        yield session
+    finally:
+        session.close()
+
+
+@pytest.fixture
+def fake_session(monkeypatch):
+    """替换 SSHJumpSession 的假会话，不连接远端，只记录创建的实例和收到的命令。
+
+    按测试需要覆盖类属性：connect_errors 按 ip 指定 connect 时抛出的异常，respond 决定每条命令的输出。
+    """
+
+    class FakeSession:
+        created: list["FakeSession"] = []
+        connect_errors: dict[str, Exception] = {}
+
+        def __init__(self, cfg, target_ip, target_user):
+            self.target_ip = target_ip
+            self.target_user = target_user
+            self.commands: list[str] = []
+            self.connected = False
+            self.closed = False
+            self.last_exit_code = None
+            FakeSession.created.append(self)
+
+        def respond(self, command):
+            return "ok"
+
+        def connect(self):
+            if self.target_ip in self.connect_errors:
+                raise self.connect_errors[self.target_ip]
+            self.connected = True
+
+        def is_alive(self):
+            return self.connected and not self.closed
+
+        def exec_command(self, command):
+            return self.exec_commands([command])[0]
+
+        def exec_commands(self, commands):
+            self.commands.extend(commands)
+            return [
+                {"command": command, "output": self.respond(command), "exit_code": 0, "alive": True}
+                for command in commands
+            ]
+
+        def exec_stream(self, command):
+            self.commands.append(command)
+            yield self.respond(command)
+
+        def close(self):
+            self.closed = True
+
+    monkeypatch.setattr(jump_ssh, "SSHJumpSession", FakeSession)
+    return FakeSession
+
+
 def test_resolve_woodpecker_watch_dir_uses_explicit_value(tmp_path):
     explicit_dir = tmp_path / "woodpecker-watch"
     (explicit_dir / "woodpecker_watch").mkdir(parents=True)
@@ -117,24 +191,8 @@ def test_resolve_woodpecker_verify_host_uses_single_allowed_host_by_default():
     assert host == "VM-4-13"
 
 
-def test_remote_kubectl_runner_executes_command_via_jump_session(monkeypatch):
-    calls = []
-
-    class FakeSession:
-        def __init__(self, cfg, target_ip, target_user):
-            calls.append(("init", target_ip, target_user))
-
-        def connect(self):
-            calls.append(("connect",))
-
-        def exec_command(self, command):
-            calls.append(("exec_command", command))
-            return {"output": '{"ok": true}', "exit_code": 0}
-
-        def close(self):
-            calls.append(("close",))
-
-    monkeypatch.setattr(jump_ssh, "SSHJumpSession", FakeSession)
+def test_remote_kubectl_runner_executes_command_via_jump_session(fake_session):
+    fake_session.respond = lambda session, command: '{"ok": true}'
     cfg = {
         "jumpserver": {"host": "1.1.1.1", "port": 2222, "user": "u"},
         "allowed_hosts": [{"name": "VM-4-13", "ip": "192.168.4.13", "user": "root"}],
@@ -150,4 +208,417 @@ def test_remote_kubectl_runner_executes_command_via_jump_session(monkeypatch):
 
     assert result.returncode == 0
     assert result.stdout == '{"ok": true}'
-    assert ("exec_command", "kubectl -n default get deployment agentic-service -o json") in calls
+    session = fake_session.created[0]
+    assert (session.target_ip, session.target_user) == ("192.168.4.13", "root")
+    assert session.commands == ["kubectl -n default get deployment agentic-service -o json"]
+    assert session.closed
+
+
+def test_ssh_options_enable_control_master_by_default(monkeypatch, tmp_path):
+    monkeypatch.setattr(jump_ssh, "CONTROL_DIR", tmp_path / "cm")
+    cfg = {"jumpserver": {"host": "1.1.1.1", "port": 2222, "user": "u"}}
+    session = jump_ssh.SSHJumpSession(cfg, "192.168.4.13", "root")
+
+    options = session._ssh_options()
+
+    assert "ControlMaster=auto" in options
+    assert f"ControlPath={tmp_path / 'cm' / '%C'}" in options
+    assert "ControlPersist=600" in options
+    assert "Compression=yes" in options
+    assert options[-2:] == ["-l", "u@root@192.168.4.13"]
+    assert (tmp_path / "cm").is_dir()
+
+
+def test_ssh_options_skip_control_master_when_multiplex_disabled(monkeypatch, tmp_path):
+    monkeypatch.setattr(jump_ssh, "CONTROL_DIR", tmp_path / "cm")
+    cfg = {"jumpserver": {"host": "1.1.1.1", "port": 2222, "user": "u", "multiplex": False, "compress": False}}
+    session = jump_ssh.SSHJumpSession(cfg, "192.168.4.13", "root")
+
+    options = session._ssh_options()
+
+    assert not any(item.startswith("Control") for item in options)
+    assert "Compression=no" in options
+    assert session.master_alive() is False
+
+
+def test_session_manager_run_pooled_reuses_session_and_reaps_idle(fake_session):
+    cfg = {
+        "jumpserver": {"host": "1.1.1.1", "port": 2222, "user": "u"},
+        "allowed_hosts": [{"name": "VM-4-13", "ip": "192.168.4.13", "user": "root", "default_workdir": "/opt"}],
+    }
+    manager = jump_ssh.SessionManager(cfg)
+
+    first = manager.run_pooled("vm-4-13", ["pwd"], None)
+    manager.run_pooled("VM-4-13", ["ls"], "/tmp")
+
+    assert len(fake_session.created) == 1
+    assert fake_session.created[0].commands == ["( eval 'cd /opt && pwd' )", "( eval 'cd /tmp && ls' )"]
+    assert first["results"][0]["command"] == "cd /opt && pwd"
+    assert first["host"] == "VM-4-13"
+    assert manager.reap_idle(3600) == 0
+    assert manager.reap_idle(-1) == 1
+    assert fake_session.created[0].closed
+
+
+def test_session_server_reloads_whitelist_when_config_changes(monkeypatch, tmp_path):
+    monkeypatch.setattr(jump_ssh, "CACHE_DIR", tmp_path / "cache")
+    config_file = tmp_path / "config.yaml"
+    config_file.write_text("allowed_hosts:\n  - name: VM-4-13\n    ip: 192.168.4.13\n", encoding="utf-8")
+    server = jump_ssh.SessionServer(str(tmp_path / "s.sock"), jump_ssh.load_config(str(config_file)), str(config_file))
+    try:
+        config_file.write_text("allowed_hosts:\n  - name: VM-4-14\n    ip: 192.168.4.14\n", encoding="utf-8")
+        response = server.dispatch({"action": "run", "host": "VM-4-13", "commands": ["pwd"]})
+        assert response["success"] is False
+        assert "不在允许列表中" in response["error"]
+        assert jump_ssh.resolve_host("vm-4-14", server.manager.cfg)["ip"] == "192.168.4.14"
+
+        config_file.unlink()
+        assert server.dispatch({"action": "list"})["success"] is False
+    finally:
+        server.server_close()
+
+
+def test_cmd_exec_connects_directly_without_reuse_and_reports_canonical_host(fake_session, monkeypatch, capsys):
+    monkeypatch.setattr(jump_ssh, "ping_server", lambda socket_path: True)
+    monkeypatch.setattr(
+        jump_ssh, "send_session_request", lambda *args, **kwargs: pytest.fail("exec without --reuse hit the daemon")
+    )
+    cfg = {
+        "jumpserver": {"host": "1.1.1.1", "port": 2222, "user": "u"},
+        "allowed_hosts": [{"name": "VM-4-13", "ip": "192.168.4.13", "user": "root"}],
+    }
+
+    jump_ssh.cmd_exec(cfg, "vm-4-13", ["pwd"])
+
+    assert jump_ssh.loads_json(capsys.readouterr().out.encode())["host"] == "VM-4-13"
+
+
+def test_exec_commands_collects_each_result_from_one_round_trip(local_bash_session):
+    results = local_bash_session.exec_commands(["echo first", "false", "printf 'a\\nb\\n'"])
+
+    assert [item["output"] for item in results] == ["first", "", "a\nb"]
+    assert [item["exit_code"] for item in results] == [0, 1, 0]
+    assert [item["command"] for item in results] == ["echo first", "false", "printf 'a\\nb\\n'"]
+
+
+def test_exec_commands_isolates_comment_background_and_partial_syntax(local_bash_session):
+    local_bash_session.t_cmd = 5
+
+    results = local_bash_session.exec_commands(
+        ["# restart service", "sleep 0.1 &", "for i in 1 2; do", "echo after"]
+    )
+
+    assert [item["exit_code"] for item in results][:2] == [0, 0]
+    assert results[2]["exit_code"] != 0
+    assert results[3]["output"] == "after"
+    assert results[3]["exit_code"] == 0
+
+
+def test_read_commands_file_skips_blank_and_comment_lines(tmp_path):
+    commands_file = tmp_path / "cmds.txt"
+    commands_file.write_text("# sync\ngit pull\n\n  # reload\nsystemctl restart app\n", encoding="utf-8")
+
+    assert jump_ssh.read_commands_file(str(commands_file)) == ["git pull", "systemctl restart app"]
+
+
+def test_strip_ansi_removes_escape_sequences_and_carriage_returns():
+    raw = "\x1b[?2004l\x1b[32mRunning\x1b[0m\r\nplain line\r\n"
+
+    assert jump_ssh.strip_ansi(raw) == "Running\nplain line\n"
+    assert jump_ssh.strip_ansi("no escapes\r\n") == "no escapes\n"
+
+
+def test_load_config_reuses_cache_until_file_changes(monkeypatch, tmp_path):
+    monkeypatch.setattr(jump_ssh, "CACHE_DIR", tmp_path / "cache")
+    config_file = tmp_path / "config.yaml"
+    config_file.write_text("jumpserver:\n  host: 1.1.1.1\n", encoding="utf-8")
+
+    first = jump_ssh.load_config(str(config_file))
+    cache_file = jump_ssh.config_cache_path(config_file.resolve())
+    monkeypatch.setattr(jump_ssh.yaml, "load", lambda *args, **kwargs: pytest.fail("should hit cache"))
+    second = jump_ssh.load_config(str(config_file))
+    monkeypatch.undo()
+    monkeypatch.setattr(jump_ssh, "CACHE_DIR", tmp_path / "cache")
+    config_file.write_text("jumpserver:\n  host: 10.0.0.2\n", encoding="utf-8")
+    third = jump_ssh.load_config(str(config_file))
+
+    assert first == second == {"jumpserver": {"host": "1.1.1.1"}}
+    assert third == {"jumpserver": {"host": "10.0.0.2"}}
+    assert cache_file.stat().st_mode & 0o777 == 0o600
+
+
+def test_lookup_host_uses_case_insensitive_name_index():
+    cfg = {
+        "allowed_hosts": [
+            {"name": "VM-4-13", "ip": "192.168.4.13", "user": "root"},
+            {"name": "vm-4-13", "ip": "192.168.4.99"},
+        ]
+    }
+
+    host, target_ip, target_user, workdir = jump_ssh.lookup_host(cfg, "Vm-4-13")
+
+    assert host["ip"] == target_ip == "192.168.4.13"
+    assert (target_user, workdir) == ("root", None)
+    assert set(cfg["_host_index"]) == {"vm-4-13"}
+    with pytest.raises(ValueError):
+        jump_ssh.lookup_host(cfg, "missing")
+
+
+def test_answer_login_sends_password_then_stops_at_shell_prompt():
+    cfg = {"jumpserver": {"host": "1.1.1.1", "port": 2222, "user": "u", "password": "secret"}}
+    session = jump_ssh.SSHJumpSession(cfg, "192.168.4.13", "root")
+    child = jump_ssh.pexpect.spawn(
+        "sh",
+        ["-c", "printf 'Password: '; read p; printf 'got %s\\n$ ' \"$p\"; sleep 5"],
+        encoding="utf-8",
+        timeout=5,
+    )
+    try:
+        outcome = session._answer_login(child, jump_ssh.LOGIN_PROMPTS)
+        before = child.before
+    finally:
+        child.close(force=True)
+
+    assert outcome == "shell"
+    assert "got secret" in before
+
+
+def test_send_session_request_reads_large_response(monkeypatch, tmp_path):
+    socket_path = tmp_path / "s.sock"
+    server = jump_ssh.socket.socket(jump_ssh.socket.AF_UNIX, jump_ssh.socket.SOCK_STREAM)
+    server.bind(str(socket_path))
+    server.listen(1)
+    payload = {"success": True, "output": "x" * 1_000_000}
+
+    def serve():
+        conn, _ = server.accept()
+        with conn:
+            conn.makefile("rb").readline()
+            conn.sendall((jump_ssh.json.dumps(payload) + "\n").encode("utf-8"))
+
+    thread = jump_ssh.threading.Thread(target=serve)
+    thread.start()
+    monkeypatch.setattr(jump_ssh, "socket_path_for_config", lambda config_path: socket_path)
+    monkeypatch.setattr(jump_ssh, "ensure_server", lambda path, config_path: None)
+    try:
+        response = jump_ssh.send_session_request(None, {"action": "ping"})
+    finally:
+        thread.join(timeout=5)
+        server.close()
+
+    assert response == payload
+
+
+def test_cmd_exec_all_runs_every_allowed_host_and_reports_failures(fake_session, monkeypatch):
+    captured = []
+    fake_session.connect_errors = {"192.168.1.102": RuntimeError("SSH 连接超时")}
+    fake_session.respond = lambda session, command: session.target_ip
+    monkeypatch.setattr(jump_ssh, "print_json", captured.append)
+    cfg = {
+        "allowed_hosts": [
+            {"name": "VM-4-13", "ip": "192.168.1.100", "user": "root"},
+            {"name": "IDC-2080", "ip": "192.168.1.101", "user": "root"},
+            {"name": "jenkins-arm", "ip": "192.168.1.102", "user": "root"},
+        ]
+    }
+
+    with pytest.raises(SystemExit):
+        jump_ssh.cmd_exec_all(cfg, ["uptime"])
+
+    hosts = captured[0]["hosts"]
+    assert captured[0]["success"] is False
+    assert hosts["VM-4-13"]["output"] == "192.168.1.100"
+    assert hosts["IDC-2080"]["success"] is True
+    assert hosts["jenkins-arm"]["error"] == "RuntimeError: SSH 连接超时"
+
+
+def test_cmd_exec_all_runs_duplicate_host_names_once_under_canonical_name(fake_session, monkeypatch):
+    captured = []
+    monkeypatch.setattr(jump_ssh, "print_json", captured.append)
+    cfg = {
+        "allowed_hosts": [
+            {"name": "VM-4-13", "ip": "192.168.1.100", "user": "root"},
+            {"name": "IDC-2080", "ip": "192.168.1.101", "user": "root"},
+        ]
+    }
+
+    jump_ssh.cmd_exec_all(cfg, ["uptime"], ["vm-4-13", "VM-4-13", "idc-2080", "vm-4-13"])
+
+    assert sorted(session.target_ip for session in fake_session.created) == ["192.168.1.100", "192.168.1.101"]
+    assert list(captured[0]["hosts"]) == ["VM-4-13", "IDC-2080"]
+    assert captured[0]["hosts"]["VM-4-13"]["host"] == "VM-4-13"
+
+
+def test_exec_commands_disables_terminal_echo_on_first_batch(local_bash_session):
+    first = local_bash_session.exec_command("echo one")
+    second = local_bash_session.exec_command("stty -a")
+
+    assert first["output"] == "one"
+    assert "-echo " in second["output"]
+    assert local_bash_session.shell_prepared
+
+
+def test_exec_commands_finds_marker_followed_by_large_buffered_output(local_bash_session):
+    results = local_bash_session.exec_commands(["echo small", "seq 1 20000"])
+
+    assert results[0]["output"] == "small"
+    assert results[1]["output"].splitlines()[-1] == "20000"
+
+
+def test_connect_spawns_wide_dumb_terminal(monkeypatch, tmp_path):
+    spawned = {}
+
+    class FakeChild:
+        def close(self, force=False):
+            pass
+
+    def fake_spawn(command, args, **kwargs):
+        spawned.update(command=command, args=args, **kwargs)
+        return FakeChild()
+
+    monkeypatch.setattr(jump_ssh, "CONTROL_DIR", tmp_path / "cm")
+    monkeypatch.setattr(jump_ssh.pexpect, "spawn", fake_spawn)
+    monkeypatch.setattr(jump_ssh.SSHJumpSession, "_answer_login", lambda self, child, prompts: "shell")
+    cfg = {"jumpserver": {"host": "1.1.1.1", "port": 2222, "user": "u"}}
+    session = jump_ssh.SSHJumpSession(cfg, "192.168.4.13", "root")
+
+    session.connect()
+
+    assert spawned["command"] == "ssh"
+    assert spawned["args"][0] == "-tt"
+    assert spawned["dimensions"] == (24, 512)
+    assert spawned["env"]["TERM"] == "dumb"
+    assert isinstance(session.child, FakeChild)
+
+
+@pytest.mark.parametrize("use_orjson", [True, False])
+def test_print_json_output_matches_stdlib_format(monkeypatch, capsys, use_orjson):
+    if use_orjson:
+        pytest.importorskip("orjson")
+    else:
+        monkeypatch.setattr(jump_ssh, "orjson", None)
+    payloads = [
+        {"success": True, "output": "命名空间\nline", "exit_code": 0, "hosts": [{"ip": None}]},
+        {"success": True, "size": 2**70},
+    ]
+
+    for payload in payloads:
+        jump_ssh.print_json(payload)
+
+    expected = "".join(jump_ssh.json.dumps(payload, ensure_ascii=False, indent=2) + "\n" for payload in payloads)
+    assert capsys.readouterr().out == expected
+
+
+def test_resolved_config_path_defaults_to_skill_resources():
+    default = jump_ssh.resolved_config_path(None)
+
+    assert default == jump_ssh.skill_dir() / "resources" / "config.yaml"
+    assert default is jump_ssh.default_config_path()
+    assert default.is_absolute()
+
+
+def test_exec_stream_yields_output_and_keeps_session_usable(local_bash_session):
+    chunks = list(local_bash_session.exec_stream("seq 1 50000; printf '\\033[32mok\\033[0m\\n'; exit_with() { return 3; }; exit_with"))
+    exit_code = local_bash_session.last_exit_code
+    after = local_bash_session.exec_command("echo still-alive")
+
+    expected = "".join(f"{index}\n" for index in range(1, 50001)) + "ok\n"
+    assert "".join(chunks) == expected
+    assert len(chunks) > 1
+    assert exit_code == 3
+    assert after["output"] == "still-alive"
+
+
+def test_exec_stream_closes_session_when_caller_stops_early(local_bash_session):
+    stream = local_bash_session.exec_stream("seq 1 1000000")
+    assert next(stream)
+
+    stream.close()
+
+    assert not local_bash_session.is_alive()
+    assert not local_bash_session.command_lock.locked()
+
+
+def test_exec_stream_holds_back_escape_sequence_straddling_the_marker_window(monkeypatch):
+    class FakeChild:
+        def __init__(self, chunks):
+            self.chunks = list(chunks)
+            self.buffer = ""
+
+        def isalive(self):
+            return True
+
+        def read_nonblocking(self, size, timeout):
+            return self.chunks.pop(0)
+
+    token = "t_0"
+    window = len(f"{jump_ssh.EXIT_MARKER} {token} ")
+    # 覆盖退出标记回看窗口的起点落在 \x1b[32m 之前、之中、之后的各种填充长度
+    for pad in range(window - 10, window + 5):
+        session = jump_ssh.SSHJumpSession({"jumpserver": {"host": "1.1.1.1", "port": 2222, "user": "u"}}, "192.168.4.13", "root")
+        session.child = FakeChild(
+            [
+                "\nx\x1b[32m" + "y" * pad,
+                f"{jump_ssh.EXIT_MARKER} {token} 0\r\n{jump_ssh.END_MARKER} {token}\r\n$ ",
+            ]
+        )
+        monkeypatch.setattr(session, "_send_batch", lambda commands: [token])
+
+        assert "".join(session.exec_stream("true")) == "x" + "y" * pad
+        assert session.last_exit_code == 0
+
+
+def test_exec_command_does_not_block_on_pager_under_dumb_terminal(local_bash_session, tmp_path):
+    repo = tmp_path / "repo"
+    jump_ssh.subprocess.run(["git", "init", "-q", str(repo)], check=True)
+    jump_ssh.subprocess.run(
+        ["git", "-C", str(repo), "-c", "user.name=t", "-c", "user.email=t@example.com", "commit", "-q", "--allow-empty", "-m", "hello pager"],
+        check=True,
+    )
+    local_bash_session.t_cmd = 5
+
+    result = local_bash_session.exec_command(f"cd {repo} && git log -1 --format=%s")
+
+    assert result["output"] == "hello pager"
+    assert result["exit_code"] == 0
+
+
+def test_cmd_exec_stream_reports_unknown_host_on_stderr(capsys):
+    cfg = {"allowed_hosts": [{"name": "VM-4-13", "ip": "192.168.4.13"}]}
+
+    with pytest.raises(SystemExit) as exc_info:
+        jump_ssh.cmd_exec_stream(cfg, "VM-9-99", "pwd")
+
+    captured = capsys.readouterr()
+    assert exc_info.value.code == 1
+    assert captured.out == ""
+    assert "不在允许列表中" in captured.err
+
+
+def test_cmd_exec_stream_treats_closed_stdout_as_normal_exit(fake_session, monkeypatch):
+    class ClosedStdout(io.StringIO):
+        def write(self, text):
+            raise BrokenPipeError
+
+    monkeypatch.setattr(jump_ssh.sys, "stdout", ClosedStdout())
+    cfg = {"allowed_hosts": [{"name": "VM-4-13", "ip": "192.168.4.13"}]}
+
+    with pytest.raises(SystemExit) as exc_info:
+        jump_ssh.cmd_exec_stream(cfg, "VM-4-13", "seq 1 1000000")
+
+    assert exc_info.value.code == 0
+    assert fake_session.created[0].closed
+
+
+def test_main_rejects_stream_with_cmds_file_before_reading_it(monkeypatch, capsys, tmp_path):
+    empty = tmp_path / "empty.txt"
+    empty.write_text("", encoding="utf-8")
+    monkeypatch.setattr(jump_ssh.sys, "argv", ["jump_ssh.py", "exec", "--host", "VM-4-13", "--stream", "--cmds-file", str(empty)])
+
+    with pytest.raises(SystemExit) as exc_info:
+        jump_ssh.main()
+
+    captured = capsys.readouterr()
+    assert exc_info.value.code == 2
+    assert captured.out == ""
+    assert "--stream 只支持单条 --cmd" in captured.err